@@ -0,0 +1,113 @@
+'''
+Measure the cold-start import time of each entry module,
+each in a fresh Python process, and check that headless
+modules (those used by batch jobs and workers which only
+load and reduce data) do not pull in heavy plotting,
+regridding or progress dependencies.
+
+Run from the repository root:
+    python benchmarks/import_time.py [--repeat 5] [--budget 2.0]
+'''
+from pathlib import Path
+import argparse
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Entry modules, and whether they should import without heavy dependencies
+MODULES = {
+    'libs.utils': True,
+    'libs.GcmData.GcmDataLoader': True,
+    'libs.GcmData.GcmDataLoaderExocam': True,
+    'libs.GcmData.GcmDataLoaderRocke3d': True,
+    'libs.GcmData.GcmUtilsAccessor': True,
+    'libs.GcmData.GcmCatalog': True,
+    'libs.render': False,
+}
+
+HEAVY_MODULES = [
+    'cartopy',
+    'dask.diagnostics',
+    'matplotlib.pyplot',
+    'xesmf',
+]
+
+
+def import_time(module):
+    '''
+    Cumulative import time of `module` in seconds, as reported
+    by `python -X importtime`, and the heavy modules it imported.
+    Raises `ImportError` with the last line of its traceback
+    if it fails to import.
+    '''
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-X', 'importtime',
+            '-c', f'import sys, {module}; print(" ".join(sys.modules))'
+        ],
+        capture_output=True,
+        cwd=ROOT,
+        text=True
+    )
+
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise ImportError(lines[-1] if len(lines) > 0 else 'unknown error')
+
+    # Lines are: import time: self [us] | cumulative | imported package
+    cumulative = 0
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1])
+
+    imported = result.stdout.split()
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+
+    return cumulative / 1e6, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=None,
+        help='maximum median import time in seconds of headless modules'
+    )
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"module":<40} {"median (s)":>10} {"min (s)":>10}  heavy imports')
+    for module, headless in MODULES.items():
+        times = []
+        try:
+            for _ in range(args.repeat):
+                t, heavy = import_time(module)
+                times.append(t)
+        except ImportError as e:
+            print(f'{module:<40} {"-":>10} {"-":>10}')
+            print(f'  FAIL: import error ({e})')
+            failed = True
+            continue
+
+        times.sort()
+        median = times[len(times) // 2]
+        print(f'{module:<40} {median:>10.3f} {times[0]:>10.3f}  {", ".join(heavy)}')
+
+        if headless and len(heavy) > 0:
+            print(f'  FAIL: headless module imports {", ".join(heavy)}')
+            failed = True
+
+        if headless and args.budget != None and median > args.budget:
+            print(f'  FAIL: over budget of {args.budget:.3f}s')
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
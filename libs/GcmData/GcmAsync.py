@@ -0,0 +1,102 @@
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import asyncio
+import threading
+
+from dask.callbacks import Callback
+
+# Background executor shared by all async operations, created on
+# first use. Pass `executor` to the async methods to use another
+EXECUTOR_MAX_WORKERS = 4
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor == None:
+        _executor = ThreadPoolExecutor(
+            max_workers=EXECUTOR_MAX_WORKERS,
+            thread_name_prefix='gcm'
+        )
+
+    return _executor
+
+
+class GcmProgressCallback(Callback):
+    '''
+    Dask callback reporting the fraction of tasks finished to
+    `progress` (run on the event loop, if given), and aborting
+    the computation once `cancel_event` is set.
+    '''
+    def __init__(
+        self,
+        progress=None,
+        cancel_event=None,
+        loop=None
+    ):
+        super().__init__()
+        self.cancel_event = cancel_event or threading.Event()
+        self.loop = loop
+        self.progress = progress
+
+        self._reported = None
+        self._total = 0
+
+    def _report(self, fraction):
+        # Only report whole percentages, to avoid flooding the event loop
+        percent = int(fraction * 100)
+        if self.progress == None or percent == self._reported:
+            return
+
+        self._reported = percent
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(self.progress, fraction)
+        else:
+            self.progress(fraction)
+
+    def _start_state(self, dsk, state):
+        self._reported = None
+        self._total = sum(
+            len(state[k]) for k in ('ready', 'waiting', 'running', 'finished')
+        )
+        self._report(0.0)
+
+    def _pretask(self, key, dsk, state):
+        if self.cancel_event.is_set():
+            raise CancelledError()
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        self._total > 0 and self._report(len(state['finished']) / self._total)
+
+    def _finish(self, dsk, state, errored):
+        errored or self._report(1.0)
+
+
+def run_async(
+    func,
+    progress=None,
+    executor=None
+):
+    '''
+    Run `func(callbacks)` on a background thread, returning an
+    asyncio future which can be awaited or cancelled. `func`
+    should pass `callbacks` on to dask's compute, so `progress`
+    is called with the fraction of tasks done and cancelling
+    the future stops the computation at its next task. Must be
+    called from a running event loop, e.g. a notebook cell.
+    '''
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    callback = GcmProgressCallback(
+        progress=progress,
+        cancel_event=cancel_event,
+        loop=loop
+    )
+
+    future = loop.run_in_executor(
+        executor or get_executor(),
+        func,
+        [callback._callback]
+    )
+    future.add_done_callback(lambda f: f.cancelled() and cancel_event.set())
+
+    return future
@@ -0,0 +1,374 @@
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import xarray
+
+from .GcmDataLoaderRocke3d import parse_date
+from .GcmUtilsAccessor import month_index
+
+ROCKE3D_KINDS = ['aijk', 'aijl', 'aij']
+UNIT_DAYS = {
+    'days': 1,
+    'hours': 1 / 24,
+    'minutes': 1 / 1440,
+    'seconds': 1 / 86400
+}
+
+
+def parse_filename(filepath):
+    '''
+    Identify a ROCKE-3D (e.g. ANN0414.aij{id}.nc) or ExoCAM
+    (e.g. {id}.cam.h0.0001-01.nc) history file from its name,
+    returning its run id, kind, period, year and month,
+    or None if it is neither. The period of ExoCAM files
+    can't be told from their name, so is left as None
+    to be read from the header.
+    '''
+    filepath = Path(filepath)
+    name = filepath.name
+    if not name.endswith('.nc'):
+        return None
+
+    if '.cam.h0.' in name:
+        try:
+            run_id, date = name[:-3].split('.cam.h0.')
+            year, month = date.split('-')[0:2]
+
+            return {
+                'run_id': run_id,
+                'kind': 'cam.h0',
+                'period': None,
+                'year': int(year),
+                'month': int(month)
+            }
+        except ValueError:
+            return None
+
+    parts = name.split('.')
+    if len(parts) != 3:
+        return None
+
+    # Prefer the run directory name, as run ids may start with k or l
+    kinds = [k for k in ROCKE3D_KINDS if parts[1] == k + filepath.parent.name]
+    kinds = kinds or [k for k in ROCKE3D_KINDS if parts[1].startswith(k)]
+    if len(kinds) == 0:
+        return None
+
+    try:
+        year, month = parse_date(name)
+    except ValueError:
+        return None
+
+    return {
+        'run_id': parts[1][len(kinds[0]):],
+        'kind': kinds[0],
+        'period': 'ann' if parts[0].startswith('ANN') else 'mon',
+        'year': year,
+        'month': month
+    }
+
+
+def header_period(data):
+    '''
+    'ann', 'mon' or None (e.g. for ExoCAM's ~10 day output) from
+    the width of the averaging intervals in the time bounds,
+    or else the spacing of the (undecoded) times.
+    '''
+    if 'time' not in data.variables:
+        return None
+
+    unit = data['time'].attrs.get('units', '').split(' ')[0]
+    if unit not in UNIT_DAYS:
+        return None
+
+    bounds = data['time'].attrs.get('bounds', 'time_bnds')
+    if bounds in data.variables:
+        widths = np.diff(data[bounds].values, axis=-1)
+    elif data['time'].size > 1:
+        widths = np.diff(data['time'].values)
+    else:
+        return None
+
+    width = float(np.median(widths)) * UNIT_DAYS[unit]
+    if 28 <= width <= 31:
+        return 'mon'
+    if 365 <= width <= 366:
+        return 'ann'
+
+    return None
+
+
+def read_header(filepath):
+    # Only reads metadata (and the time bounds), no variable data is
+    # loaded. Errors are returned rather than raised, so one bad file
+    # doesn't stop a scan
+    try:
+        with xarray.open_dataset(filepath, decode_cf=False) as data:
+            return {
+                'dims': dict(data.sizes),
+                'period': header_period(data),
+                'variables': {
+                    v: {
+                        'dims': list(data[v].dims),
+                        'dtype': str(data[v].dtype)
+                    }
+                    for v in data.data_vars
+                }
+            }
+    except Exception as e:
+        return { 'error': f'{type(e).__name__}: {e}' }
+
+
+class GcmCatalog():
+    def __init__(
+        self,
+        path='catalog.sqlite'
+    ):
+        self.path = str(path)
+
+        # The connection is shared between threads (e.g. loaders run
+        # by `load_async`), so every query holds the lock
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                run_id TEXT,
+                kind TEXT,
+                period TEXT,
+                year INTEGER,
+                month INTEGER,
+                month_index INTEGER,
+                dims TEXT,
+                size INTEGER,
+                mtime REAL
+            );
+            CREATE TABLE IF NOT EXISTS variables (
+                path TEXT,
+                name TEXT,
+                dims TEXT,
+                dtype TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_run ON files (run_id, kind, month_index);
+            CREATE INDEX IF NOT EXISTS variables_path ON variables (path);
+            CREATE INDEX IF NOT EXISTS variables_name ON variables (name);
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def update(
+        self,
+        dirs,
+        workers=None
+    ):
+        '''
+        Scan `dirs` for ROCKE-3D and ExoCAM history files, reading
+        headers (in parallel) only of files which are new or
+        whose size or mtime changed. Files that have since been
+        removed from `dirs` are dropped from the catalog, and
+        unreadable files are skipped and listed under 'failed'.
+        '''
+        dirs = [dirs] if isinstance(dirs, (str, Path)) else dirs
+
+        found = {}
+        for d in dirs:
+            for root, _, filenames in os.walk(d):
+                for filename in filenames:
+                    filepath = os.path.abspath(os.path.join(root, filename))
+                    info = parse_filename(filepath)
+                    if info != None:
+                        stat = os.stat(filepath)
+                        found[filepath] = {
+                            **info,
+                            'mtime': stat.st_mtime,
+                            'size': stat.st_size
+                        }
+
+        known = {}
+        for d in dirs:
+            prefix = os.path.join(os.path.abspath(d), '')
+            rows = self._query(
+                'SELECT path, size, mtime FROM files WHERE substr(path, 1, ?) = ?',
+                (len(prefix), prefix)
+            )
+            known.update({ r[0]: (r[1], r[2]) for r in rows })
+
+        removed = [p for p in known if p not in found]
+        changed = [
+            p for p in found
+            if known.get(p) != (found[p]['size'], found[p]['mtime'])
+        ]
+
+        headers = []
+        if len(changed) > 0:
+            print(f'Reading {len(changed)} headers')
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                headers = list(executor.map(read_header, changed, chunksize=16))
+
+        failed = {
+            filepath: header['error']
+            for filepath, header in zip(changed, headers)
+            if 'error' in header
+        }
+        for filepath, error in failed.items():
+            print(f'Warning: skipping unreadable file {filepath} ({error})')
+
+        with self._lock, self.db:
+            for filepath in [*removed, *changed]:
+                self.db.execute('DELETE FROM files WHERE path = ?', (filepath,))
+                self.db.execute('DELETE FROM variables WHERE path = ?', (filepath,))
+
+            for filepath, header in zip(changed, headers):
+                if filepath in failed:
+                    continue
+
+                info = found[filepath]
+                self.db.execute(
+                    'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        filepath,
+                        info['run_id'],
+                        info['kind'],
+                        info['period'] or header['period'],
+                        info['year'],
+                        info['month'],
+                        month_index((info['year'], info['month'])),
+                        json.dumps(header['dims']),
+                        info['size'],
+                        info['mtime']
+                    )
+                )
+                self.db.executemany(
+                    'INSERT INTO variables VALUES (?, ?, ?, ?)',
+                    [
+                        (filepath, v, json.dumps(meta['dims']), meta['dtype'])
+                        for v, meta in header['variables'].items()
+                    ]
+                )
+
+        return {
+            'changed': len(changed) - len(failed),
+            'failed': list(failed),
+            'removed': len(removed),
+            'total': len(found) - len(failed)
+        }
+
+    def _where(
+        self,
+        run_id=None,
+        kind=None,
+        period=None,
+        start=None,
+        end=None
+    ):
+        clauses = []
+        params = []
+        for column, value in (('run_id', run_id), ('kind', kind), ('period', period)):
+            if value != None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+
+        if start != None:
+            clauses.append('month_index >= ?')
+            params.append(month_index(start))
+
+        if end != None:
+            clauses.append('month_index <= ?')
+            params.append(month_index(end))
+
+        where = ' AND '.join(clauses) if len(clauses) > 0 else '1'
+
+        return where, params
+
+    def files(
+        self,
+        pattern=None,
+        run_id=None,
+        kind=None,
+        period=None,
+        start=None,
+        end=None
+    ):
+        '''
+        Filepaths matching the glob `pattern` (as passed to the
+        loaders), run id, kind (aij, aijk, aijl or cam.h0),
+        period (ann or mon, files of other or unknown periods never
+        match) and inclusive time range, in time order.
+        '''
+        where, params = self._where(run_id, kind, period, start, end)
+        rows = self._query(
+            f'SELECT path FROM files WHERE {where} ORDER BY month_index, path',
+            params
+        )
+        files = [r[0] for r in rows]
+
+        if pattern != None:
+            pattern = os.path.abspath(str(pattern))
+            files = [f for f in files if fnmatch(f, pattern)]
+
+        return files
+
+    def runs(self):
+        rows = self._query('SELECT DISTINCT run_id FROM files ORDER BY run_id')
+
+        return [r[0] for r in rows]
+
+    def variables(
+        self,
+        run_id=None,
+        kind=None
+    ):
+        '''
+        Variables available in the matching files, with their dims.
+        '''
+        where, params = self._where(run_id, kind)
+        rows = self._query(
+            f'''
+                SELECT DISTINCT variables.name, variables.dims
+                FROM variables JOIN files ON files.path = variables.path
+                WHERE {where} ORDER BY variables.name
+            ''',
+            params
+        )
+
+        return { r[0]: json.loads(r[1]) for r in rows }
+
+    def time_range(
+        self,
+        run_id=None,
+        kind=None
+    ):
+        '''
+        First and last (year, month) of the matching files.
+        '''
+        where, params = self._where(run_id, kind)
+        first, last = self._query(
+            f'SELECT MIN(month_index), MAX(month_index) FROM files WHERE {where}',
+            params
+        )[0]
+
+        if first == None:
+            return None
+
+        return (
+            (first // 12, first % 12 + 1),
+            (last // 12, last % 12 + 1)
+        )
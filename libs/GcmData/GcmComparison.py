@@ -0,0 +1,345 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cftime
+import numpy as np
+import xarray
+
+from . import GcmUtilsAccessor
+from .GcmUtilsAccessor import TIME_UNITS
+
+HORIZONTAL_DIMS = ('lat', 'lon')
+
+
+class GcmComparison():
+    '''
+    Compare two runs (e.g. ROCKE-3D against ExoCAM) on a common
+    grid. Standardised surface variables (dims time, lat, lon)
+    shared by both are averaged into monthly means if needed
+    (e.g. ExoCAM's ~10 day output), matched by period (annual
+    or monthly), year and month, remapped, and the difference
+    (a - b) reduced chunk by chunk, so only a few chunks of
+    `chunk_size` timesteps are in memory at once.
+    '''
+    def __init__(
+        self,
+        data_a,
+        data_b,
+        chunk_size=12,
+        grid=None,
+        periods=(None, None),
+        vars=None,
+        workers=4,
+        year_offset=0
+    ):
+        '''
+        - `data_a`, `data_b`: loaded Datasets, or loaders to load
+        - `grid`: Dataset with the lat and lon to remap to,
+            defaults to the coarser of the two grids
+        - `periods`: period ('ann' or 'mon') of a and b, inferred
+            from their times if None. If one is annual, the other
+            is reduced to annual means of its complete years
+        - `year_offset`: added to the years of `data_b` before
+            matching times, for runs with different start years
+        '''
+        self.data_a = self._prepare(data_a)
+        self.data_b = self._prepare(data_b)
+
+        self.chunk_size = chunk_size
+        self.vars = self.shared_vars() if vars == None else vars
+        self.workers = workers
+        self.year_offset = year_offset
+
+        # Average sub-monthly or end-stamped (CAM) output into
+        # monthly means before matching periods
+        if self.needs_monthly(self.data_a):
+            self.data_a = self.to_monthly(self.data_a)
+        if self.needs_monthly(self.data_b):
+            self.data_b = self.to_monthly(self.data_b)
+
+        # Inferring the period also checks for duplicate timesteps
+        period_a = self.period(self.data_a)
+        period_b = self.period(self.data_b)
+        period_a = periods[0] or period_a
+        period_b = periods[1] or period_b
+        if period_a == 'ann' and period_b == 'mon':
+            self.data_b = self.to_annual(self.data_b)
+        elif period_a == 'mon' and period_b == 'ann':
+            self.data_a = self.to_annual(self.data_a)
+
+        if type(grid) == type(None):
+            size_a = self.data_a.lat.size * self.data_a.lon.size
+            size_b = self.data_b.lat.size * self.data_b.lon.size
+            grid = self.data_a if size_a <= size_b else self.data_b
+
+        self.lat = grid['lat'].values
+        self.lon = grid['lon'].values
+
+    def _prepare(self, data):
+        if not isinstance(data, xarray.Dataset):
+            data = data.load()
+
+        if 'cell' in data.dims:
+            data = data.gcm_utils.expand_points()
+
+        if 'time_days' not in data.coords:
+            data = data.gcm_utils.add_time_index()
+
+        return data
+
+    def shared_vars(self):
+        def is_surface(data, v):
+            return set(data[v].dims) == { 'time', *HORIZONTAL_DIMS }
+
+        return [
+            v for v in self.data_a.data_vars
+            if v in self.data_b.data_vars
+            and is_surface(self.data_a, v)
+            and is_surface(self.data_b, v)
+        ]
+
+    def needs_monthly(self, data):
+        '''
+        Whether `data` has time bounds (as kept by the ExoCAM
+        loader, since CAM stamps averages at the end of their
+        interval), or several distinct timesteps in a month.
+        '''
+        if 'time_bnds' in data:
+            return True
+
+        days = data['time_days'].values
+        codes = data['time_year'].values * 12 + data['time_month'].values - 1
+
+        return len(np.unique(days)) == len(days) \
+            and len(np.unique(codes)) < len(codes)
+
+    def interval_days(self, data):
+        '''
+        Start and end, in days, of the averaging interval of each
+        timestep. Taken from `time_bnds` if present, otherwise
+        each timestep is assumed to be stamped at the end of its
+        interval, as CAM does.
+        '''
+        calendar = data['time'].values[0].calendar
+
+        if 'time_bnds' in data:
+            bounds = data['time_bnds'].transpose('time', ...).values
+            if bounds.dtype == object:
+                bounds = cftime.date2num(bounds, TIME_UNITS, calendar)
+            return bounds[:, 0], bounds[:, -1]
+
+        end = cftime.date2num(data['time'].values, TIME_UNITS, calendar)
+        step = np.diff(end)
+        step = np.concatenate([step[:1], step]) if len(step) > 0 else np.ones(1)
+
+        return end - step, end
+
+    def _weighted_mean(self, data, weights, codes, dim):
+        # Mean of `self.vars` over timesteps grouped by `codes`,
+        # weighting each by `weights` and ignoring NaNs
+        data_vars = data[self.vars].assign_coords({ dim: ('time', codes) })
+        weights = xarray.DataArray(
+            weights,
+            dims='time',
+            coords={ dim: ('time', codes) }
+        )
+
+        total = (data_vars * weights).groupby(dim).sum('time')
+        norm = (data_vars.notnull() * weights).groupby(dim).sum('time')
+        mean = total / norm
+
+        for v in self.vars:
+            mean[v].attrs = data[v].attrs
+
+        return mean.assign_attrs(data.attrs)
+
+    def _month_start(self, codes, calendar):
+        return [
+            cftime.datetime(c // 12, c % 12 + 1, 1, calendar=calendar)
+            for c in codes
+        ]
+
+    def to_monthly(self, data):
+        '''
+        Monthly means of `data`, assigning each timestep to the
+        month of the midpoint of its averaging interval, weighted
+        by the length of the interval. Stamped at the start of the
+        month, like ROCKE-3D monthly files.
+        '''
+        calendar = data['time'].values[0].calendar
+        start, end = self.interval_days(data)
+
+        midpoints = cftime.num2date((start + end) / 2, TIME_UNITS, calendar)
+        codes = np.array([d.year * 12 + d.month - 1 for d in midpoints])
+
+        data = self._weighted_mean(data, end - start, codes, 'month_code')
+        codes = data['month_code'].values
+
+        return data\
+            .rename({ 'month_code': 'time' })\
+            .assign_coords({ 'time': self._month_start(codes, calendar) })\
+            .gcm_utils.add_time_index()
+
+    def period(self, data):
+        '''
+        'ann' for annual means (stamped as January by the ROCKE-3D
+        loader) or 'mon' for monthly means, inferred from the time
+        index (after `to_monthly`). Raises if a year and month
+        occurs more than once, e.g. when ANN and monthly ROCKE-3D
+        files are loaded together.
+        '''
+        codes = data['time_year'].values * 12 + data['time_month'].values - 1
+        if len(np.unique(codes)) != len(codes):
+            raise ValueError(
+                f'{data.attrs.get("id")} has duplicate year/month timesteps, '
+                'e.g. from loading ANN and monthly files together'
+            )
+
+        days = np.sort(data['time_days'].values)
+        if np.all(data['time_month'].values == 1) \
+            and (len(days) == 1 or np.diff(days).min() >= 365):
+            return 'ann'
+
+        return 'mon'
+
+    def to_annual(self, data):
+        '''
+        Annual means of the complete years of monthly `data`,
+        weighting each month by its length in days, as ROCKE-3D
+        ANN files average over every timestep of the year.
+        Stamped as January like ROCKE-3D ANN files.
+        '''
+        years, counts = np.unique(data['time_year'].values, return_counts=True)
+        years = years[counts == 12]
+        if len(years) == 0:
+            raise ValueError(f'{data.attrs.get("id")} has no complete years to compare')
+
+        data = data.isel(time=np.flatnonzero(np.isin(data['time_year'].values, years)))
+
+        calendar = data['time'].values[0].calendar
+        codes = data['time_year'].values * 12 + data['time_month'].values - 1
+        month_lengths = cftime.date2num(self._month_start(codes + 1, calendar), TIME_UNITS, calendar) \
+            - cftime.date2num(self._month_start(codes, calendar), TIME_UNITS, calendar)
+
+        data = self._weighted_mean(data, month_lengths, data['time_year'].values, 'year')
+
+        return data\
+            .rename({ 'year': 'time' })\
+            .assign_coords({
+                'time': [cftime.datetime(y, 1, 1, calendar=calendar) for y in years]
+            })\
+            .gcm_utils.add_time_index()
+
+    def align(self):
+        '''
+        Indices of the timesteps of a and b which share the same
+        year and month, in time order. Both have the same period
+        and no duplicate timesteps, as checked by `period`.
+        '''
+        def codes(data, year_offset=0):
+            return (data['time_year'].values + year_offset) * 12 \
+                + data['time_month'].values - 1
+
+        _, index_a, index_b = np.intersect1d(
+            codes(self.data_a),
+            codes(self.data_b, self.year_offset),
+            return_indices=True
+        )
+
+        return index_a, index_b
+
+    def remap(self, data):
+        # Interpolate one dimension at a time, so edges can be extrapolated
+        interp_kwargs = { 'fill_value': 'extrapolate' }
+        if not np.array_equal(data.lat.values, self.lat):
+            data = data.interp(lat=self.lat, kwargs=interp_kwargs)
+        if not np.array_equal(data.lon.values, self.lon):
+            data = data.interp(lon=self.lon, kwargs=interp_kwargs)
+
+        return data
+
+    def _reduce_chunk(self, index_a, index_b):
+        # Each chunk is loaded without dask's thread pool, as
+        # chunks are already being reduced in parallel
+        data_a = self.data_a[self.vars]\
+            .isel(time=index_a)\
+            .load(scheduler='synchronous')
+        data_b = self.data_b[self.vars]\
+            .isel(time=index_b)\
+            .load(scheduler='synchronous')
+
+        # Use the times of a, so both share a calendar
+        data_b = data_b\
+            .drop_vars([c for c in data_b.coords if c != 'time' and 'time' in data_b[c].dims])\
+            .assign_coords({ 'time': data_a['time'].values })
+
+        diff = self.remap(data_a) - self.remap(data_b)
+        diff_sq = diff ** 2
+
+        return {
+            'bias': diff.gcm_utils.weighted_lat().mean(HORIZONTAL_DIMS),
+            'count': diff.notnull().sum('time'),
+            'rmse_global': np.sqrt(diff_sq.gcm_utils.weighted_lat().mean(HORIZONTAL_DIMS)),
+            'sum': diff.sum('time'),
+            'sum_sq': diff_sq.sum('time')
+        }
+
+    def run(self):
+        '''
+        Returns a dict of Datasets, each holding the compared vars:
+        - `diff_mean`: time-mean difference (a - b) per grid cell
+        - `rmse`: root mean square difference per grid cell
+        - `bias`: area-weighted mean difference per timestep
+        - `rmse_global`: area-weighted RMS difference per timestep
+        '''
+        index_a, index_b = self.align()
+        if len(index_a) == 0:
+            raise ValueError('No matching times to compare')
+
+        chunks = iter([
+            (index_a[i:i + self.chunk_size], index_b[i:i + self.chunk_size])
+            for i in range(0, len(index_a), self.chunk_size)
+        ])
+
+        totals = {}
+        series = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Keep a bounded number of chunks in flight to limit memory
+            pending = {}
+            position = 0
+            while True:
+                for chunk in chunks:
+                    pending[executor.submit(self._reduce_chunk, *chunk)] = position
+                    position += 1
+                    if len(pending) >= self.workers:
+                        break
+
+                if len(pending) == 0:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    partial = future.result()
+                    series[pending.pop(future)] = partial
+
+                    for k in ('count', 'sum', 'sum_sq'):
+                        totals[k] = partial[k] if k not in totals else totals[k] + partial[k]
+                        del partial[k]
+
+        order = sorted(series)
+        count = totals['count'].where(totals['count'] > 0)
+        results = {
+            'bias': xarray.concat([series[i]['bias'] for i in order], 'time'),
+            'diff_mean': totals['sum'] / count,
+            'rmse': np.sqrt(totals['sum_sq'] / count),
+            'rmse_global': xarray.concat([series[i]['rmse_global'] for i in order], 'time')
+        }
+
+        for k in results:
+            for v in self.vars:
+                results[k][v].attrs = self.data_a[v].attrs
+            results[k] = results[k].assign_attrs({
+                'compare_a': self.data_a.attrs.get('id'),
+                'compare_b': self.data_b.attrs.get('id')
+            })
+
+        return results
@@ -1,4 +1,3 @@
-from dask.diagnostics import ProgressBar
 from datetime import timedelta
 import numpy as np
 import xarray
@@ -11,24 +10,96 @@ class GcmDataLoader():
         self,
         id,
         path='',
-        keep_vars=[]
+        keep_vars=[],
+        memory_mode=False,
+        precision_keep_vars=['areacella'],
+        sparse_vars=[],
+        sparse_mask_var=None,
+        catalog=None,
+        time_range=None
     ):
         self.id = id
 
         self.path = str(path).format(id=id)
         self.keep_vars = keep_vars
+        self.memory_mode = memory_mode
+        self.precision_keep_vars = precision_keep_vars
+        self.sparse_vars = sparse_vars
+        self.sparse_mask_var = sparse_mask_var
+        self.catalog = catalog
+        self.time_range = time_range
+
+    def resolve_files(self, path):
+        '''
+        Files to load for the glob `path`. If a `GcmCatalog` is
+        set, they are looked up in its index (limited to the
+        inclusive `time_range`, e.g. ('0400-01', '0420-12') or
+        ((400, 1), (420, 12)), as also accepted by
+        `.gcm_utils.slice_period`), rather than globbing the filesystem.
+        Without a catalog, all matching files are opened and
+        `time_range` is applied after loading.
+        '''
+        if self.catalog == None:
+            return path
+
+        start, end = self.time_range or (None, None)
+        files = self.catalog.files(pattern=path, start=start, end=end)
+        if len(files) == 0:
+            raise FileNotFoundError(f'No catalogued files match {path}')
+
+        return files
+
+    def select_time_range(self, data):
+        '''
+        Limit loaded data to the inclusive `time_range`, if set,
+        whether or not the files were resolved by a catalog.
+        '''
+        if self.time_range == None:
+            return data
+
+        return data.gcm_utils.slice_period(*self.time_range)
 
     def load(self):
         data = xarray.open_mfdataset(
-            self.path,
+            self.resolve_files(self.path),
             combine='nested',
             concat_dim='time',
             autoclose=True,
             use_cftime=True
         )
 
+        # Integer time codes for fast selection and grouping
+        data = data.gcm_utils.add_time_index()
+        data = self.select_time_range(data)
+
         return data
 
+    def load_async(
+        self,
+        compute=False,
+        progress=None,
+        executor=None
+    ):
+        '''
+        Run `load` on a background thread, returning an awaitable
+        (and cancellable) asyncio future, so several runs can be
+        loaded while the notebook stays responsive. If `compute`
+        is set, the data is also read into memory, with `progress`
+        called with the fraction of tasks done.
+
+        NB opening and standardising the files (`load` itself)
+        reports no progress and cannot be interrupted: cancelling
+        only takes effect before it starts, or during `compute`.
+        '''
+        from .GcmAsync import run_async
+
+        def load(callbacks):
+            data = self.load()
+
+            return data.compute(callbacks=callbacks) if compute else data
+
+        return run_async(load, progress=progress, executor=executor)
+
     def standardise_vars(self, data_orig):
         data = data_orig.copy()
 
@@ -55,6 +126,39 @@ class GcmDataLoader():
 
         return data
 
+    def reduce_memory(self, data):
+        '''
+        Reduce the memory used by standardised data, if
+        `memory_mode` is set. Float64 variables are downcast
+        to float32, except those in `precision_keep_vars`,
+        and `sparse_vars` (e.g. ocean or sea ice only fields)
+        are stored as lists of their non-NaN grid points. Use
+        `.gcm_utils.expand_points()` to get the full grid back.
+
+        NB this turns the lazy open into a full read of every
+        `sparse_vars` variable (and the raw variables they are
+        derived from) over the whole record, to find which
+        points are ever non-NaN. Set `sparse_mask_var` to a var
+        with a static footprint (e.g. 'sst') to only read its
+        first timestep instead, dropping any values outside it.
+        '''
+        if not self.memory_mode:
+            return data
+
+        print('Reducing memory')
+        for v in data.data_vars:
+            if v not in self.precision_keep_vars and data[v].dtype == np.float64:
+                data[v] = data[v].astype(np.float32)
+
+        sparse_vars = [v for v in self.sparse_vars if v in data]
+        if len(sparse_vars) > 0:
+            data = data.gcm_utils.compress_points(
+                sparse_vars,
+                mask_var=self.sparse_mask_var
+            )
+
+        return data
+
     def var_attrs(self, v=None):
         '''
         Attributes of mapped variables.
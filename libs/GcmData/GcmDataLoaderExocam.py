@@ -23,17 +23,29 @@ class GcmDataLoaderExocam(GcmDataLoader):
             'P0',
             'PS',
             'Z3'
-        ]
+        ],
+        memory_mode=False,
+        precision_keep_vars=['areacella'],
+        sparse_vars=[],
+        sparse_mask_var=None,
+        catalog=None,
+        time_range=None
     ):   
         super().__init__(
             id,
             path=path,
-            keep_vars=keep_vars
+            keep_vars=keep_vars,
+            memory_mode=memory_mode,
+            precision_keep_vars=precision_keep_vars,
+            sparse_vars=sparse_vars,
+            sparse_mask_var=sparse_mask_var,
+            catalog=catalog,
+            time_range=time_range
         )
 
     def load(self):
         data = xarray.open_mfdataset(
-            self.path,
+            self.resolve_files(self.path),
             combine='nested',
             concat_dim='time',
             autoclose=True,
@@ -57,7 +69,19 @@ class GcmDataLoaderExocam(GcmDataLoader):
 
         # Standardise variables and units
         print('Standardising vars')
-        data = self.standardise_vars(data)
+        data_std = self.standardise_vars(data)
+
+        data_std = self.reduce_memory(data_std)
+
+        # Keep the averaging intervals, as CAM stamps each
+        # time average at the end of its interval
+        if 'time_bnds' in data:
+            data_std = data_std.assign({ 'time_bnds': data['time_bnds'] })
+        data = data_std
+
+        # Integer time codes for fast selection and grouping
+        data = data.gcm_utils.add_time_index()
+        data = self.select_time_range(data)
 
         return data
 
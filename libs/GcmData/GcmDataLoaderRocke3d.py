@@ -9,19 +9,25 @@ from .GcmDataLoader import GcmDataLoader
 # Disable warning when using .rename() which removes coord indexes
 warnings.filterwarnings('ignore', category=UserWarning)
 
-def set_date(data):
+def parse_date(filepath):
     # Retrieve month + year from filename (format e.g. APR0001) 
     # Although year can be variable in size
-    date_mmmy = data.encoding['source'].split('/').pop().split('.')[0]
+    date_mmmy = str(filepath).split('/').pop().split('.')[0]
 
     # Extract month number from filename
     month_number = 1
     if date_mmmy[0:3] != 'ANN':
         month_number = datetime.strptime(date_mmmy[0:3], '%b').month
 
+    return int(date_mmmy[3:]), month_number
+
+
+def set_date(data):
+    year, month_number = parse_date(data.encoding['source'])
+
     # Convert to time
     time = cftime.DatetimeNoLeap(
-        int(date_mmmy[3:]),
+        year,
         month_number,
         1
     )
@@ -62,7 +68,21 @@ class GcmDataLoaderRocke3d(GcmDataLoader):
             't_850',
             'topog',
             'z'
-        ]
+        ],
+        memory_mode=False,
+        precision_keep_vars=['areacella'],
+        # NB with memory_mode, sparse_vars are read in full at load
+        # to find their points, unless sparse_mask_var is set
+        sparse_vars=[
+            'siconc',
+            'sisnthick',
+            'sithick',
+            'so',
+            'sst'
+        ],
+        sparse_mask_var=None,
+        catalog=None,
+        time_range=None
     ):
         self.path_vert = {}
         self.preprocess = preprocess
@@ -73,12 +93,18 @@ class GcmDataLoaderRocke3d(GcmDataLoader):
         super().__init__(
             id,
             path=path,
-            keep_vars=keep_vars
+            keep_vars=keep_vars,
+            memory_mode=memory_mode,
+            precision_keep_vars=precision_keep_vars,
+            sparse_vars=sparse_vars,
+            sparse_mask_var=sparse_mask_var,
+            catalog=catalog,
+            time_range=time_range
         )
 
     def load(self):
         data = xarray.open_mfdataset(
-            self.path,
+            self.resolve_files(self.path),
             autoclose=True,
             combine='nested',
             concat_dim='time',
@@ -91,7 +117,7 @@ class GcmDataLoaderRocke3d(GcmDataLoader):
             print('Extracting vertical data')
             try:            
                 data_aijk = xarray.open_mfdataset(
-                    self.path_vert['aijk'],
+                    self.resolve_files(self.path_vert['aijk']),
                     autoclose=True,
                     combine='nested',
                     concat_dim='time',
@@ -127,7 +153,7 @@ class GcmDataLoaderRocke3d(GcmDataLoader):
                     )
 
                 data_aijl = xarray.open_mfdataset(
-                    self.path_vert['aijl'],
+                    self.resolve_files(self.path_vert['aijl']),
                     autoclose=True,
                     combine='nested',
                     concat_dim='time',
@@ -169,6 +195,12 @@ class GcmDataLoaderRocke3d(GcmDataLoader):
             print('Standardising vars')
             data = self.standardise_vars(data)
 
+        data = self.reduce_memory(data)
+
+        # Integer time codes for fast selection and grouping
+        data = data.gcm_utils.add_time_index()
+        data = self.select_time_range(data)
+
         return data
 
     def var_map(self):
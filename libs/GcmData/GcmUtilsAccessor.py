@@ -1,10 +1,111 @@
-from dask.diagnostics import ProgressBar
-from datetime import timedelta
 from pathlib import Path
+import json
+import os
 
+import cftime
 import numpy as np
 import xarray
 
+SHARED_METADATA = 'metadata.json'
+TIME_UNITS = 'days since 0001-01-01'
+
+# Days from 0001-01-01 to 1970-01-01 (proleptic gregorian)
+TIME_INDEX_UNIX_OFFSET = 719162
+# Season code of each month: 0 = DJF, 1 = MAM, 2 = JJA, 3 = SON
+SEASON_CODES = np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
+
+
+def month_index(value):
+    '''
+    Convert a (year, month) tuple, 'YYYY-MM[-DD]' string or
+    date-like object to a sortable number of months.
+    '''
+    if isinstance(value, str):
+        year, month = value.split('-')[0:2]
+    elif isinstance(value, (tuple, list)):
+        year, month = value
+    else:
+        year, month = value.year, value.month
+
+    return int(year) * 12 + int(month) - 1
+
+
+def _json_default(value):
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+def _export_variable(path, name, variable):
+    values = variable.data
+    encoding = {}
+
+    # cftime dates are stored as numbers, and decoded on open
+    if variable.dtype == object:
+        if variable.size == 0 or not isinstance(variable.values.flat[0], cftime.datetime):
+            raise TypeError(
+                f'Cannot export {name}: object arrays other than cftime dates '
+                'cannot be memory-mapped, drop or convert it first'
+            )
+
+        encoding = {
+            'calendar': variable.values.flat[0].calendar,
+            'units': TIME_UNITS
+        }
+        values = cftime.date2num(variable.values, **encoding)
+
+    # Write to a temporary file and rename it into place, so
+    # workers attached to a previous export keep their mapping
+    filename = f'{name}.npy'
+    filepath_tmp = path / f'{filename}.tmp'
+    target = np.lib.format.open_memmap(
+        filepath_tmp,
+        mode='w+',
+        dtype=values.dtype,
+        shape=values.shape
+    )
+
+    # Write dask arrays chunk by chunk, without loading them whole
+    if hasattr(values, 'dask'):
+        values.store(target, lock=False)
+    else:
+        target[...] = values
+
+    target.flush()
+    del target
+    os.replace(filepath_tmp, path / filename)
+
+    return {
+        'attrs': variable.attrs,
+        'dims': list(variable.dims),
+        'encoding': encoding,
+        'file': filename
+    }
+
+
+def open_shared(path):
+    '''
+    Attach to a store written by `.gcm_utils.export_shared()`,
+    returning a Dataset backed by read-only memory maps. Every
+    process opening the same store shares one page-cached
+    copy of the data, and nothing is read until it is used.
+    '''
+    path = Path(path)
+    with open(path / SHARED_METADATA) as f:
+        metadata = json.load(f)
+
+    def attach(meta):
+        values = np.load(path / meta['file'], mmap_mode='r')
+        if meta['encoding']:
+            values = cftime.num2date(values, **meta['encoding'])
+
+        return xarray.Variable(meta['dims'], values, attrs=meta['attrs'])
+
+    return xarray.Dataset(
+        { v: attach(meta) for v, meta in metadata['data_vars'].items() },
+        coords={ c: attach(meta) for c, meta in metadata['coords'].items() },
+        attrs=metadata['attrs']
+    )
+
+
 # https://docs.xarray.dev/en/stable/internals/extending-xarray.html
 @xarray.register_dataset_accessor('gcm_utils')
 @xarray.register_dataarray_accessor('gcm_utils')
@@ -16,35 +117,338 @@ class GcmUtilsAccessor:
         self,
         filepath,
         engine='netcdf4',
-        unlimited_dims=['time']
+        unlimited_dims=['time'],
+        callbacks=None
     ):
+        '''
+        Write to netCDF in chunks, showing a progress bar, or
+        reporting to dask `callbacks` instead if given (as
+        done by `save_async`).
+        '''
         write = self._obj.to_netcdf(
             filepath,
             compute=False,
             engine=engine,
             unlimited_dims=unlimited_dims
         )
-        
+
+        if callbacks != None:
+            write.compute(callbacks=callbacks)
+            return
+
+        from dask.diagnostics import ProgressBar
+
         with ProgressBar():
             write.compute()
 
-    # def slice_orbits(self, start, end):
-    #     data = self._obj.copy()
-        
-    #     time_start = data.time.values[0] + timedelta(days=start)
-    #     time_end = time_start + timedelta(days=(end - start))
-    #     data_slice = data.sel(time=slice(time_start, time_end))
+    def compute_async(
+        self,
+        progress=None,
+        executor=None
+    ):
+        '''
+        Compute on a background thread without blocking the
+        notebook, returning an awaitable (and cancellable)
+        asyncio future. `progress` is called with the fraction
+        of tasks done.
+        '''
+        from .GcmAsync import run_async
 
-    #     return data_slice
+        data = self._obj
 
-    # def slice_orbits_last(self, x):
-    #     data = self._obj.copy()
-        
-    #     time_end = data.time.values[-1]
-    #     time_start = time_end - timedelta(days=x)
-    #     data_sliced = data.sel(time=slice(time_start, time_end))
+        return run_async(
+            lambda callbacks: data.compute(callbacks=callbacks),
+            progress=progress,
+            executor=executor
+        )
 
-    #     return data_sliced
+    def reduce_async(
+        self,
+        method,
+        *args,
+        progress=None,
+        executor=None,
+        **kwargs
+    ):
+        '''
+        Apply a reduction lazily, e.g. `reduce_async('mean', 'time')`,
+        and compute it in the background as `compute_async`.
+        '''
+        reduced = getattr(self._obj, method)(*args, **kwargs)
+
+        return reduced.gcm_utils.compute_async(
+            progress=progress,
+            executor=executor
+        )
+
+    def save_async(
+        self,
+        filepath,
+        progress=None,
+        executor=None,
+        **kwargs
+    ):
+        '''
+        Run `save_progressive` in the background, returning an
+        awaitable (and cancellable) asyncio future.
+        '''
+        from .GcmAsync import run_async
+
+        return run_async(
+            lambda callbacks: self.save_progressive(
+                filepath,
+                callbacks=callbacks,
+                **kwargs
+            ),
+            progress=progress,
+            executor=executor
+        )
+
+    def export_shared(
+        self,
+        path,
+        vars=None
+    ):
+        '''
+        Write variables once into a store of raw memory-mapped
+        arrays (one .npy file each) with a JSON sidecar of dims,
+        coords and attrs, to be attached with `open_shared` by
+        worker processes. A DataArray is stored under its name.
+        Exporting again replaces files rather than overwriting
+        them, so already attached workers are unaffected.
+        '''
+        data = self._obj
+        if isinstance(data, xarray.DataArray):
+            data = data.to_dataset(name=data.name or 'data')
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        vars = list(data.data_vars) if vars == None else vars
+        metadata = {
+            'attrs': data.attrs,
+            'coords': {
+                c: _export_variable(path, c, data[c].variable)
+                for c in data.coords
+            },
+            'data_vars': {
+                v: _export_variable(path, v, data[v].variable)
+                for v in vars
+            }
+        }
+
+        # Metadata is written last, once all arrays are in place
+        with open(path / f'{SHARED_METADATA}.tmp', 'w') as f:
+            json.dump(metadata, f, default=_json_default)
+        os.replace(path / f'{SHARED_METADATA}.tmp', path / SHARED_METADATA)
+
+        return path
+
+    def compress_points(
+        self,
+        vars,
+        dim='cell',
+        mask_var=None
+    ):
+        '''
+        Store `vars` as lists of the grid points which are
+        non-NaN at any time (e.g. ocean or sea ice only
+        fields), sharing a single flat grid index along `dim`.
+
+        NB finding those points reads every value of `vars` over
+        the whole record. To avoid this, pass a `mask_var` with a
+        static footprint (e.g. 'sst' for the ocean), and only
+        its first timestep is read instead. Values of `vars`
+        outside that footprint are then dropped.
+        '''
+        data = self._obj.copy()
+
+        if mask_var != None:
+            mask = data[mask_var].notnull()
+            mask = mask.isel({ d: 0 for d in mask.dims if d not in ('lat', 'lon') })
+        else:
+            mask = data[vars].notnull().to_array('variable').any('variable')
+            for d in [d for d in mask.dims if d not in ('lat', 'lon')]:
+                mask = mask.any(d)
+        index = np.flatnonzero(mask.transpose('lat', 'lon').values)
+
+        for v in vars:
+            data_var = data[v]\
+                .stack({ dim: ('lat', 'lon') }, create_index=False)\
+                .isel({ dim: index })\
+                .drop_vars(('lat', 'lon'))
+
+            data = data.drop_vars(v).assign({ v: data_var })
+            data[v].attrs['compressed'] = dim
+
+        data = data.assign_coords({ dim: index })
+
+        return data
+
+    def expand_points(
+        self,
+        vars=None,
+        dim='cell',
+        grid=None
+    ):
+        '''
+        Lazily expand variables stored by `compress_points`
+        back on to the full lat-lon grid, filling with NaN.
+        A DataArray needs the `grid` (with lat and lon) passed in.
+        '''
+        data = self._obj.copy()
+        grid = data if type(grid) == type(None) else grid
+        lat = grid['lat']
+        lon = grid['lon']
+
+        def expand(data_var):
+            data_var = data_var.reindex({ dim: np.arange(lat.size * lon.size) })
+            other_dims = [d for d in data_var.dims if d != dim]
+            data_var = data_var.transpose(*other_dims, dim)
+
+            data_var = xarray.DataArray(
+                data_var.data.reshape(*data_var.shape[:-1], lat.size, lon.size),
+                dims=(*other_dims, 'lat', 'lon'),
+                coords={
+                    **{ k: c for k, c in data_var.coords.items() if dim not in c.dims },
+                    'lat': lat.values,
+                    'lon': lon.values
+                },
+                attrs=data_var.attrs,
+                name=data_var.name
+            )
+            data_var.attrs.pop('compressed', None)
+
+            return data_var
+
+        if isinstance(data, xarray.DataArray):
+            return expand(data)
+
+        if vars == None:
+            vars = [v for v in data.data_vars if dim in data[v].dims]
+
+        for v in vars:
+            data = data.drop_vars(v).assign({ v: expand(data[v]) })
+
+        if not any(dim in data[v].dims for v in data.data_vars):
+            data = data.drop_vars(dim)
+
+        return data
+
+    def add_time_index(self):
+        '''
+        Attach integer time codes along `time`, so time
+        selection and grouping can be done by comparing
+        integers rather than cftime objects:
+        - `time_days`: whole days since 0001-01-01, in the
+            calendar of the data
+        - `time_year`, `time_month`: year and month numbers
+        - `time_season`: season code (0 = DJF, 1 = MAM, 2 = JJA, 3 = SON)
+        '''
+        data = self._obj.copy()
+        times = data['time'].values
+
+        if np.issubdtype(times.dtype, np.datetime64):
+            days = times.astype('datetime64[D]').astype(np.int64) + TIME_INDEX_UNIX_OFFSET
+        else:
+            days = cftime.date2num(times, TIME_UNITS, times[0].calendar)
+
+        months = data['time'].dt.month.values
+
+        return data.assign_coords({
+            'time_days': ('time', np.floor(days).astype(np.int64)),
+            'time_month': ('time', months.astype(np.int64)),
+            'time_season': ('time', SEASON_CODES[months - 1]),
+            'time_year': ('time', data['time'].dt.year.values.astype(np.int64))
+        })
+
+    def _with_time_index(self):
+        if 'time_days' in self._obj.coords:
+            return self._obj
+
+        return self.add_time_index()
+
+    def slice_orbits(
+        self,
+        start,
+        end,
+        orbit_days=1
+    ):
+        '''
+        Select from `start` to `end` (inclusive) orbits after the
+        first timestep, where an orbit lasts `orbit_days` days.
+        Assumes time is sorted, as done by the loaders.
+        '''
+        data = self._with_time_index()
+        days = data['time_days'].values
+
+        time_start = days[0] + start * orbit_days
+        time_end = days[0] + end * orbit_days
+
+        return data.isel(time=slice(
+            np.searchsorted(days, time_start, side='left'),
+            np.searchsorted(days, time_end, side='right')
+        ))
+
+    def slice_orbits_last(
+        self,
+        x,
+        orbit_days=1
+    ):
+        '''
+        Select the last `x` orbits, where an orbit lasts
+        `orbit_days` days. Assumes time is sorted.
+        '''
+        data = self._with_time_index()
+        days = data['time_days'].values
+
+        time_start = days[-1] - x * orbit_days
+
+        return data.isel(time=slice(
+            np.searchsorted(days, time_start, side='left'),
+            None
+        ))
+
+    def slice_period(
+        self,
+        start=None,
+        end=None
+    ):
+        '''
+        Select an inclusive range of periods, given in any form
+        accepted by `month_index`, e.g. `slice_period((414, 1), (420, 12))`
+        or `slice_period('0414-01', '0420-12')`.
+        '''
+        data = self._with_time_index()
+        codes = data['time_year'].values * 12 + data['time_month'].values - 1
+
+        mask = np.ones(codes.shape, dtype=bool)
+        if start != None:
+            mask &= codes >= month_index(start)
+        if end != None:
+            mask &= codes <= month_index(end)
+
+        return data.isel(time=np.flatnonzero(mask))
+
+    def groupby_period(
+        self,
+        period='month'
+    ):
+        '''
+        Group by `period`: 'month', 'season' or 'year'.
+        '''
+        data = self._with_time_index()
+
+        return data.groupby(f'time_{period}')
+
+    def climatology(
+        self,
+        period='month'
+    ):
+        '''
+        Mean of each `period` ('month' or 'season') across years.
+        '''
+        return self.groupby_period(period).mean('time')
 
     def regrid_data(
         self,
@@ -52,6 +456,8 @@ class GcmUtilsAccessor:
         filename=None,
         regrid_kwargs={}
     ):
+        import xesmf
+
         data = self._obj.copy()
     
         regrid = xesmf.Regridder(
@@ -63,7 +469,7 @@ class GcmUtilsAccessor:
         data_regridded = regrid(data)
     
         # filename != None and data_regridded.to_netcdf(filename)
-        filename != None and data_regridded._obj.save_progressive(filename)
+        filename != None and data_regridded.gcm_utils.save_progressive(filename)
     
         return data_regridded
 
@@ -0,0 +1,374 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+import os
+
+import cartopy.crs as ccrs
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+
+from .utils import create_figure, draw_gridlines
+
+# Figure, artists and projected grid of the current worker process.
+# Built once by `_init_worker` and reused for every frame it renders
+_worker_state = {}
+
+
+def project_grid(lon, lat, projection):
+    '''
+    Function `project_grid`
+
+    Inputs:
+    - `lon`
+        description: longitude values of the grid
+        type: array
+    - `lat`
+        description: latitude values of the grid
+        type: array
+    - `projection`
+        description: cartopy projection of the map
+        type: ccrs projection
+
+    Output:
+    - (x, y)
+        description: 2D arrays of the grid points in
+            projection coordinates, so frames can be plotted
+            without being re-projected every time
+    '''
+    lon2d, lat2d = np.meshgrid(lon, lat)
+    points = projection.transform_points(ccrs.PlateCarree(), lon2d, lat2d)
+
+    return points[..., 0], points[..., 1]
+
+
+def _init_worker(static):
+    matplotlib.use('Agg')
+
+    projection = static['projection']
+    fig, axs = create_figure(
+        height=static['height'],
+        projection=projection,
+        width=static['width']
+    )
+    ax = axs[0]
+
+    shape = static['x'].shape
+    if static['kind'] == 'quiver':
+        s = static['stride']
+        artist = ax.quiver(
+            static['x'][::s, ::s],
+            static['y'][::s, ::s],
+            np.zeros(shape)[::s, ::s],
+            np.zeros(shape)[::s, ::s],
+            transform=projection,
+            **static['plot_kwargs']
+        )
+        static['quiverkey_opts'] and ax.quiverkey(Q=artist, **static['quiverkey_opts'])
+    else:
+        artist = ax.pcolormesh(
+            static['x'],
+            static['y'],
+            np.zeros(shape),
+            shading='auto',
+            transform=projection,
+            **static['plot_kwargs']
+        )
+        static['colorbar'] and fig.colorbar(artist, ax=ax, **static['colorbar'])
+
+    ax.set_global()
+    static['coastlines'] and ax.coastlines()
+    static['gridlines'] and draw_gridlines(ax)
+
+    _worker_state.update({
+        **static,
+        'ax': ax,
+        'artist': artist,
+        'fig': fig,
+        'title': ax.set_title('')
+    })
+
+
+def _render_chunk(indices, values, titles):
+    state = _worker_state
+    paths = []
+    for i, frame, title in zip(indices, values, titles):
+        if state['kind'] == 'quiver':
+            s = state['stride']
+            u, v = state['projection'].transform_vectors(
+                ccrs.PlateCarree(),
+                state['lon2d'],
+                state['lat2d'],
+                frame[0],
+                frame[1]
+            )
+            state['artist'].set_UVC(u[::s, ::s], v[::s, ::s])
+        else:
+            state['artist'].set_array(np.ma.masked_invalid(frame).ravel())
+
+        state['title'].set_text(title)
+
+        path = os.path.join(state['output_dir'], state['filename'].format(index=i))
+        state['fig'].savefig(path, **state['savefig_kwargs'])
+        paths.append(path)
+
+    return paths
+
+
+def render_frames(
+    data,
+    output_dir,
+    coastlines=True,
+    colorbar={},
+    dim='time',
+    filename='frame_{index:05d}.png',
+    gridlines=True,
+    height=5,
+    plot_kwargs={},
+    projection=None,
+    quiverkey_opts={},
+    savefig_kwargs={},
+    stride=1,
+    title='{time}',
+    width=9,
+    workers=None
+):
+    '''
+    Function `render_frames`
+
+    Inputs:
+    - `data`
+        description: data to render, one frame per step along
+            `dim`. Pass a (u, v) tuple to render wind vectors
+            with quiver instead of a pcolormesh
+        type: xarray.DataArray|tuple
+    - `output_dir`
+        description: directory to write the PNG frames to
+        type: string|pathlib.Path
+    - `coastlines`
+        description: whether to draw coastlines
+        default: True
+        type: boolean
+    - `colorbar`
+        description: a dict of keyword arguments to pass to
+            the colorbar function. No colorbar is drawn if
+            empty or for quiver plots
+        default: {}
+        type: dict
+    - `dim`
+        description: dimension to create frames along
+        default: 'time'
+        type: string
+    - `filename`
+        description: filename of each frame, formatted with
+            the frame `index`
+        default: 'frame_{index:05d}.png'
+        type: string
+    - `gridlines`
+        description: whether to draw gridlines using
+            `libs.utils.draw_gridlines`
+        default: True
+        type: boolean
+    - `height`
+        description: how tall to make the figure
+        default: 5
+        type: integer
+    - `plot_kwargs`
+        description: a dict of keyword arguments to pass to
+            pcolormesh (or quiver). If `vmin` and `vmax` (or
+            `norm`) are not set, they are taken from the full
+            data so the colour scale is the same for every frame.
+            Likewise, a quiver `scale` is set from the mean wind
+            speed of the full data if not given
+        default: {}
+        type: dict
+    - `projection`
+        description: cartopy projection of the map
+        default: None (ccrs.PlateCarree())
+        type: None|ccrs projection
+    - `quiverkey_opts`
+        description: a dict of keyword arguments to pass to
+            quiverkey function
+        default: {}
+        type: dict
+    - `savefig_kwargs`
+        description: a dict of keyword arguments to pass to
+            savefig function
+        default: {}
+        type: dict
+    - `stride`
+        description: only plot every nth quiver in lat and lon
+        default: 1
+        type: integer
+    - `title`
+        description: title of each frame, formatted with the
+            `index` and the `time` (value along `dim`)
+        default: '{time}'
+        type: string
+    - `width`
+        description: how wide to make the figure
+        default: 9
+        type: integer
+    - `workers`
+        description: number of processes to render with
+        default: None (number of CPUs)
+        type: None|integer
+
+    Output:
+    - paths
+        description: filepaths of the rendered frames, in order
+        type: array
+    '''
+    projection = projection if type(projection) != type(None) else ccrs.PlateCarree()
+    workers = workers or os.cpu_count()
+
+    kind = 'quiver' if type(data) in (tuple, list) else 'pcolormesh'
+    first = data[0] if kind == 'quiver' else data
+    first = first.transpose(dim, 'lat', 'lon')
+
+    # Fix the colour scale (or arrow scale) from the full data, so
+    # it is the same for every frame, whichever worker renders it
+    plot_kwargs = { **plot_kwargs }
+    if kind == 'pcolormesh' and 'norm' not in plot_kwargs \
+        and ('vmin' not in plot_kwargs or 'vmax' not in plot_kwargs):
+        plot_kwargs.setdefault('vmin', float(data.min()))
+        plot_kwargs.setdefault('vmax', float(data.max()))
+
+    if kind == 'quiver' and 'scale' not in plot_kwargs:
+        # Same crude auto-scaling as matplotlib, with arrow lengths
+        # as a fraction of the axes width
+        n_arrows = first.isel(lat=slice(None, None, stride), lon=slice(None, None, stride))\
+            .isel({ dim: 0 }).size
+        mean_magnitude = float(((data[0] ** 2 + data[1] ** 2) ** 0.5).mean()) or 1.0
+        plot_kwargs['scale'] = 1.8 * mean_magnitude * max(10, np.sqrt(n_arrows))
+        plot_kwargs['scale_units'] = 'width'
+
+    # Project the grid once, rather than per frame and axis
+    x, y = project_grid(first.lon.values, first.lat.values, projection)
+    lon2d, lat2d = np.meshgrid(first.lon.values, first.lat.values)
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    static = {
+        'colorbar': colorbar,
+        'coastlines': coastlines,
+        'filename': filename,
+        'gridlines': gridlines,
+        'height': height,
+        'kind': kind,
+        'lat2d': lat2d,
+        'lon2d': lon2d,
+        'output_dir': str(output_dir),
+        'plot_kwargs': plot_kwargs,
+        'projection': projection,
+        'quiverkey_opts': quiverkey_opts,
+        'savefig_kwargs': savefig_kwargs,
+        'stride': stride,
+        'width': width,
+        'x': x,
+        'y': y
+    }
+
+    n_frames = first.sizes[dim]
+    labels = first[dim].values
+    chunk_size = max(1, int(np.ceil(n_frames / (workers * 4))))
+    chunks = [
+        np.arange(i, min(i + chunk_size, n_frames))
+        for i in range(0, n_frames, chunk_size)
+    ]
+
+    def chunk_values(indices):
+        # Only load the slice of data the worker needs
+        if kind == 'quiver':
+            u, v = [
+                d.transpose(dim, 'lat', 'lon').isel({ dim: indices }).values
+                for d in data
+            ]
+            return np.stack((u, v), axis=1)
+
+        return first.isel({ dim: indices }).values
+
+    paths = [None] * n_frames
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(static,)
+    ) as executor:
+        # Keep a bounded number of chunks in flight to limit memory
+        pending = {}
+        chunks = iter(chunks)
+        while True:
+            for indices in chunks:
+                titles = [
+                    title.format(index=i, time=labels[i]) for i in indices
+                ]
+                future = executor.submit(
+                    _render_chunk,
+                    indices,
+                    chunk_values(indices),
+                    titles
+                )
+                pending[future] = indices
+                if len(pending) >= workers * 2:
+                    break
+
+            if len(pending) == 0:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                indices = pending.pop(future)
+                for i, path in zip(indices, future.result()):
+                    paths[i] = path
+
+    return paths
+
+
+def write_animation(
+    paths,
+    filepath,
+    fps=10,
+    dpi=100
+):
+    '''
+    Function `write_animation`
+
+    Inputs:
+    - `paths`
+        description: filepaths of the frames to animate, e.g.
+            the output of `render_frames`
+        type: array
+    - `filepath`
+        description: filepath to save the animation to. A
+            .gif is written with pillow, otherwise ffmpeg is used
+        type: string
+    - `fps`
+        description: frames per second
+        default: 10
+        type: integer
+    - `dpi`
+        description: resolution of the animation
+        default: 100
+        type: integer
+
+    Output:
+    - None
+    '''
+    from matplotlib import animation
+
+    frame = plt.imread(paths[0])
+    height, width = frame.shape[0:2]
+
+    fig = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    image = ax.imshow(frame)
+
+    writer = animation.PillowWriter(fps=fps)
+    if not str(filepath).endswith('.gif'):
+        writer = animation.FFMpegWriter(fps=fps)
+
+    with writer.saving(fig, filepath, dpi):
+        for path in paths:
+            image.set_data(plt.imread(path))
+            writer.grab_frame()
+
+    plt.close(fig)
@@ -1,7 +1,6 @@
-import cartopy.crs as ccrs
-# import matplotlib
-import matplotlib.pyplot as plt
-import numpy as np
+# Plotting libraries are slow to import, so are
+# imported on first use in each function instead
+
 
 def create_figure(
     shape=(1, 1),
@@ -38,6 +37,8 @@ def create_figure(
         description: the created figure and array of axes.
         (NB you plot on each axis)
     '''
+    import matplotlib.pyplot as plt
+
     subplot_kw = {}
     if type(projection) != type(None):
         subplot_kw = {
@@ -57,7 +58,7 @@ def create_figure(
     return fig, axs
 
 
-def draw_gridlines(ax):
+def draw_gridlines(ax, force_draw=True):
     '''
     Function `draw_gridlines`
 
@@ -65,10 +66,21 @@ def draw_gridlines(ax):
     - `ax`
         description: the matplotlib axes to draw gridlines on
         type: matplotlib.axes._subplots.AxesSubplot
+    - `force_draw`
+        description: whether to draw the figure straight away
+            to hide the right hand side geo labels. Set to
+            False when drawing gridlines on several axes, and
+            call `hide_gridline_labels` once afterwards
+        default: True
+        type: boolean
 
     Output:
-    - None
+    - gridlabels
+        description: the gridliner holding the grid labels
+        type: cartopy.mpl.gridliner.Gridliner
     '''
+    import cartopy.crs as ccrs
+
     ax.gridlines(
         alpha=0.5,
         crs=ccrs.PlateCarree(),
@@ -87,10 +99,31 @@ def draw_gridlines(ax):
         # xlabel_style={'rotation': 45, 'ha':'right'},
     )
 
-    # Force draw to add label artists
-    plt.draw()
+    force_draw and hide_gridline_labels(ax.figure, [gridlabels])
+
+    return gridlabels
+
+
+def hide_gridline_labels(fig, gridlabels):
+    '''
+    Function `hide_gridline_labels`
+
+    Inputs:
+    - `fig`
+        description: the figure the gridlines were drawn on
+        type: matplotlib.figure.Figure
+    - `gridlabels`
+        description: gridliners returned by `draw_gridlines`
+        type: array
+
+    Output:
+    - None
+    '''
+    # Force a single draw of the figure to add label artists
+    fig.canvas.draw()
 
     # Remove right hand side geo artists (-60, 60)
-    for a in gridlabels.geo_label_artists:
-        if a.get_position()[0] > 0:
-            a.set_visible(False)
\ No newline at end of file
+    for g in gridlabels:
+        for a in g.geo_label_artists:
+            if a.get_position()[0] > 0:
+                a.set_visible(False)